@@ -1,34 +1,60 @@
 #!/usr/bin/env python3
 import os
-import re
 import sys
-import struct
-import mmap
-import subprocess
 from collections import deque
-import random
-import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 
 PAGE_SIZE = 4096
 PAGEMAP_ENTRY_BYTES = 8
 PFN_MASK = (1 << 55) - 1
+PROC_READ_BYTES = 4096
+# Upper bound of pagemap entries fetched by a single pread (8 MiB)
+PAGEMAP_READ_PAGES = 1 << 20
+EMPTY_PAGES = np.empty(0, dtype=np.uint64)
+
+
+def list_pids():
+    """
+    List the PIDs of all processes by scanning the numeric entries of /proc
+    """
+    with os.scandir("/proc") as it:
+        return [int(entry.name) for entry in it if entry.name.isdigit()]
+
+
+def read_proc_file(pid, name):
+    """
+    Read /proc/[pid]/<name>, return None if the process has already exited
+    """
+    try:
+        fd = os.open(f"/proc/{pid}/{name}", os.O_RDONLY)
+    except OSError:
+        return None
+    chunks = []
+    try:
+        while True:
+            chunk = os.read(fd, PROC_READ_BYTES)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    return b"".join(chunks)
 
 
 def find_pids_by_name(comm_name):
     """
     Match the process name precisely against /proc/[pid]/comm
     """
-    output = subprocess.check_output(["ps", "-eo", "pid,comm"], encoding="utf-8")
-    lines = output.splitlines()[1:]
     pids = []
-    for line in lines:
-        parts = line.strip().split(None, 1)
-        if len(parts) != 2:
-            continue
-        pid, comm = parts
-        if comm == comm_name:
-            pids.append(int(pid))
+    for pid in list_pids():
+        comm = read_proc_file(pid, "comm")
+        if comm and comm.rstrip(b"\n").decode(errors="replace") == comm_name:
+            pids.append(pid)
     return sorted(pids)
 
 
@@ -37,39 +63,47 @@ def find_pids_by_cmdline_substring(keyword):
     Fuzzy matching of keywords in command lines, such as python3 test.py
     """
     current_pid = os.getpid()
-    script_name = os.path.basename(__file__)
-    output = subprocess.check_output(["ps", "-eo", "pid,args"], encoding="utf-8")
-    lines = output.splitlines()[1:]
+    script_name = os.path.basename(__file__).encode()
+    keyword = keyword.encode()
     pids = []
-    for line in lines:
-        if keyword in line:
-            parts = line.strip().split(None, 1)
-            if len(parts) != 2:
-                continue
-            pid_str, cmdline = parts
-            try:
-                pid = int(pid_str)
-                # Excludes itself and scripts with the same name
-                if pid == current_pid or script_name in cmdline:
-                    continue
-                pids.append(pid)
-            except:
-                continue
+    for pid in list_pids():
+        raw = read_proc_file(pid, "cmdline")
+        if not raw:
+            continue
+        # Compare raw bytes, arguments are NUL separated in /proc/[pid]/cmdline
+        cmdline = raw.rstrip(b"\0").replace(b"\0", b" ")
+        if keyword not in cmdline:
+            continue
+        # Excludes itself and scripts with the same name
+        if pid == current_pid or script_name in cmdline:
+            continue
+        pids.append(pid)
     return sorted(pids)
 
 
-def find_all_descendants(pids):
+def build_child_map():
     """
-    Starting from the main PID list, recursively search all child processes.
+    Map every PID to the list of its direct children using /proc/[pid]/stat
     """
-    output = subprocess.check_output(["ps", "-eo", "pid,ppid"], encoding="utf-8")
     child_map = {}
-    for line in output.splitlines()[1:]:
-        parts = line.strip().split()
-        if len(parts) != 2:
+    for pid in list_pids():
+        stat = read_proc_file(pid, "stat")
+        if not stat:
+            continue
+        # comm may contain spaces and parentheses, fields resume after the last ')'
+        fields = stat[stat.rfind(b")") + 2 :].split()
+        if len(fields) < 2:
             continue
-        pid, ppid = int(parts[0]), int(parts[1])
-        child_map.setdefault(ppid, []).append(pid)
+        child_map.setdefault(int(fields[1]), []).append(pid)
+    return child_map
+
+
+def find_all_descendants(pids, child_map=None):
+    """
+    Starting from the main PID list, recursively search all child processes.
+    """
+    if child_map is None:
+        child_map = build_child_map()
 
     all_pids = set(pids)
     queue = deque(pids)
@@ -85,15 +119,17 @@ def find_all_descendants(pids):
 def parse_maps(pid):
     ranges = []
     try:
-        with open(f"/proc/{pid}/maps") as f:
+        with open(f"/proc/{pid}/maps", "rb") as f:
             for line in f:
-                m = re.match(r"([0-9a-f]+)-([0-9a-f]+)\s+(\S+)", line)
-                if not m:
+                # "start-end perms offset dev inode [pathname]"
+                dash = line.find(b"-")
+                space = line.find(b" ", dash)
+                if dash <= 0 or space < 0:
                     continue
-                start = int(m.group(1), 16)
-                end = int(m.group(2), 16)
-                perms = m.group(3)
-                if "r" in perms:  # 可读段才读取
+                start = int(line[:dash], 16)
+                end = int(line[dash + 1 : space], 16)
+                perms = line[space + 1 : space + 5]
+                if b"r" in perms:  # 可读段才读取
                     ranges.append((start, end))
     except Exception as e:
         print(f" Failed to parse maps for PID {pid}: {e}")
@@ -104,76 +140,101 @@ def parse_rw_anon_maps(pid):
     """只提取匿名 rw-p 段（无文件名）"""
     ranges = []
     try:
-        with open(f"/proc/{pid}/maps") as f:
+        with open(f"/proc/{pid}/maps", "rb") as f:
             for line in f:
-                m = re.match(
-                    r"([0-9a-f]+)-([0-9a-f]+)\s+([rwxps-]+)\s+[0-9a-f]+\s+[0-9a-f:]+\s+\d+\s*(.*)",
-                    line,
-                )
-                if not m:
+                fields = line.split()
+                # Anonymous mappings have no pathname, i.e. only 5 fields
+                if len(fields) != 5:
                     continue
-                start, end = int(m.group(1), 16), int(m.group(2), 16)
-                perms = m.group(3)
-                pathname = m.group(4)
-                if (
-                    "r" in perms
-                    and "w" in perms
-                    and "p" in perms
-                    and pathname.strip() == ""
-                ):
-                    ranges.append((start, end))
+                perms = fields[1]
+                if b"r" in perms and b"w" in perms and b"p" in perms:
+                    start, end = fields[0].split(b"-")
+                    ranges.append((int(start, 16), int(end, 16)))
     except Exception as e:
         print(f" Failed to parse maps for PID {pid}: {e}")
     return ranges
 
 
-def read_pagemap_entries(pid, vaddrs):
+def coalesce_ranges(ranges):
+    """
+    Join virtual ranges that touch each other, so adjacent VMAs share a read
+    """
+    coalesced = []
+    for start, end in sorted(ranges):
+        if coalesced and start <= coalesced[-1][1]:
+            coalesced[-1] = (coalesced[-1][0], max(end, coalesced[-1][1]))
+        else:
+            coalesced.append((start, end))
+    return coalesced
+
+
+def read_pagemap_entries(pid, ranges):
+    """
+    Read the pagemap slice of every (start, end) virtual range with one pread
+    per chunk and return (vaddrs, paddrs) uint64 arrays of all present pages.
+    """
     pagemap_path = f"/proc/{pid}/pagemap"
-    results = []
+    vaddr_chunks = []
+    paddr_chunks = []
+    # pagemap can not be mmap()ed (procfs reports a zero size and has no mmap
+    # support), so positional reads are the cheapest way to fetch it.
     try:
-        with open(pagemap_path, "rb") as f:
-            for vaddr in vaddrs:
-                index = (vaddr // PAGE_SIZE) * PAGEMAP_ENTRY_BYTES
-                f.seek(index)
-                data = f.read(8)
-                if len(data) != 8:
-                    continue
-                entry = struct.unpack("Q", data)[0]
-                present = (entry >> 63) & 1
-                pfn = entry & PFN_MASK
-                if present and pfn != 0:
-                    phys_addr = pfn * PAGE_SIZE
-                    results.append((vaddr, phys_addr))
+        fd = os.open(pagemap_path, os.O_RDONLY)
     except Exception as e:
         print(f" Failed to read pagemap for PID {pid}: {e}")
-    return results
+        return EMPTY_PAGES, EMPTY_PAGES
+    try:
+        for start, end in coalesce_ranges(ranges):
+            first = start // PAGE_SIZE
+            last = end // PAGE_SIZE
+            while first < last:
+                # Bound a single read so huge reserved VMAs do not need a
+                # buffer of their full pagemap size.
+                npages = min(last - first, PAGEMAP_READ_PAGES)
+                buf = os.pread(
+                    fd, npages * PAGEMAP_ENTRY_BYTES, first * PAGEMAP_ENTRY_BYTES
+                )
+                if not buf:
+                    break
+                count = len(buf) // PAGEMAP_ENTRY_BYTES
+                entries = np.frombuffer(buf, dtype="<u8", count=count)
+                pfns = entries & np.uint64(PFN_MASK)
+                present = ((entries >> np.uint64(63)) != 0) & (pfns != 0)
+                indexes = np.nonzero(present)[0].astype(np.uint64)
+                vaddr_chunks.append((indexes + np.uint64(first)) * np.uint64(PAGE_SIZE))
+                paddr_chunks.append(pfns[present] * np.uint64(PAGE_SIZE))
+                first += count
+    except Exception as e:
+        print(f" Failed to read pagemap for PID {pid}: {e}")
+    finally:
+        os.close(fd)
+    if not vaddr_chunks:
+        return EMPTY_PAGES, EMPTY_PAGES
+    return np.concatenate(vaddr_chunks), np.concatenate(paddr_chunks)
 
 
 def get_phys_for_pid(pid):
-    vaddrs = []
-    for start, end in parse_maps(pid):
-        for addr in range(start, end, PAGE_SIZE):
-            vaddrs.append(addr)
-
-    entries = read_pagemap_entries(pid, vaddrs)
+    entries = read_pagemap_entries(pid, parse_maps(pid))
     return entries
 
 
-def merge_ranges(ranges):
+def merge_ranges(pages):
     """
-    Merge consecutive physical address page ranges
+    Merge the physical pages starting at the given addresses into consecutive
+    (start, end) ranges, duplicated pages are allowed
     """
-    if not ranges:
+    if len(pages) == 0:
         return []
-    sorted_ranges = sorted(ranges)
-    merged = [sorted_ranges[0]]
-    for start, end in sorted_ranges[1:]:
-        last_start, last_end = merged[-1]
-        if start == last_end:
-            merged[-1] = (last_start, end)
-        else:
-            merged.append((start, end))
-    return merged
+    # np.unique sorts and drops pages shared by several processes
+    starts = np.unique(np.asarray(pages, dtype=np.uint64))
+    # A new merged range begins wherever a page does not follow its predecessor
+    breaks = np.empty(len(starts), dtype=bool)
+    breaks[0] = True
+    breaks[1:] = starts[1:] != starts[:-1] + np.uint64(PAGE_SIZE)
+    firsts = np.nonzero(breaks)[0]
+    lasts = np.append(firsts[1:] - 1, len(starts) - 1)
+    ends = starts[lasts] + np.uint64(PAGE_SIZE)
+    return list(zip(starts[firsts].tolist(), ends.tolist()))
 
 
 if __name__ == "__main__":
@@ -213,11 +274,11 @@ if __name__ == "__main__":
         sys.exit(1)
     all_pids = find_all_descendants(base_pids)
 
-    all_phys = set()
-    for pid in all_pids:
-        entries = get_phys_for_pid(pid)
-        for vaddr, paddr in entries:
-            all_phys.add((paddr, paddr + PAGE_SIZE))
+    # pread releases the GIL, so threads overlap the per-PID pagemap reads
+    workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        entries = list(executor.map(get_phys_for_pid, all_pids))
+    all_phys = np.concatenate([paddrs for _, paddrs in entries])
 
     merged_ranges = merge_ranges(all_phys)
     for start, end in merged_ranges:
@@ -1,14 +1,40 @@
 import gdb
 
+from logger import flush_logger
+from parser import parse_args_safely
+
 
 class BuildCmd(gdb.Command):
-    def __init__(self, target):
+    # name -> BuildCmd of every user-defined command
+    commands = {}
+
+    def __init__(self, target, parser=None):
         self.__doc__ = target.__doc__
         super(BuildCmd, self).__init__(target.__name__, gdb.COMMAND_USER)
         self.target = target
+        # When a parser is bound, target receives the parsed namespace
+        # instead of the raw argument string.
+        self.parser = parser
+        BuildCmd.commands[target.__name__] = self
+
+    @classmethod
+    def with_parser(cls, parser):
+        """Build a command whose arguments are parsed by the prebuilt `parser`."""
+        return lambda target: cls(target, parser)
 
     def complete(self, text, word):
         return gdb.COMPLETE_NONE
 
     def invoke(self, args, from_tty):
-        return self.target(args)
+        try:
+            if self.parser is None:
+                return self.target(args)
+
+            parsed = parse_args_safely(self.parser, args)
+            if parsed is None:
+                return
+            return self.target(parsed)
+        finally:
+            # Rows logged by the command are batched, write them out when it
+            # ends, even if it failed half way.
+            flush_logger()
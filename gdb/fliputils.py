@@ -1,6 +1,10 @@
 import argparse
+import bisect
+import functools
+import itertools
 import os
 import random
+import string
 import sys
 import time
 import uuid
@@ -12,7 +16,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-from parser import parse_args_safely
+from parser import QuietArgumentParser, parse_args_safely
 
 from buildcmd import BuildCmd
 from logger import init_logger
@@ -24,7 +28,7 @@ def listram(args):
     """List all RAM ranges allocated by QEMU."""
 
     print("QEMU RAM list:")
-    memory = mtree()["memory"]
+    memory = mtree(refresh=True)["memory"]
     for start, end in memory.ram_ranges():
         print("  RAM allocated from 0x%x to 0x%x" % (start, end))
     print("Sampled index: 0x%x" % memory.random_address())
@@ -35,7 +39,7 @@ def listreg(args):
     """List all CPU registers available in QEMU."""
 
     print("QEMU CPU register list:")
-    register = Registers()
+    register = get_registers()
     lr = register.list_registers()
     maxlen = max(len(r.name) for r, nb in lr)
     print("  REG:", "Name".rjust(maxlen), "->", "Bytes")
@@ -43,57 +47,62 @@ def listreg(args):
         print("  REG:", register.name.rjust(maxlen), "->", num_bytes)
 
 
-@BuildCmd
-def stop_delayed(args):
-    """Stop the QEMU instance after a delay of the input nano-seconds."""
+_STOP_DELAYED_PARSER = QuietArgumentParser(
+    description="Stop the QEMU instance after a delay", prog="stop_delayed"
+)
+_STOP_DELAYED_PARSER.add_argument(
+    "--ns", type=float, required=True, help="Nanoseconds to delay before stopping"
+)
 
-    parser = argparse.ArgumentParser(
-        description="Stop the QEMU instance after a delay", prog="stop_delayed"
-    )
-    parser.add_argument(
-        "--ns", type=float, required=True, help="Nanoseconds to delay before stopping"
-    )
 
-    parsed = parse_args_safely(parser, args)
-    if parsed is None:
-        return
+@BuildCmd.with_parser(_STOP_DELAYED_PARSER)
+def stop_delayed(parsed):
+    """Stop the QEMU instance after a delay of the input nano-seconds."""
 
     step_ns(parsed.ns)
 
 
-@BuildCmd
-def inject(args):
+_INJECT_PARSER = QuietArgumentParser(
+    description="Inject a bitflip at an address", prog="inject"
+)
+_INJECT_PARSER.add_argument(
+    "--address",
+    required=True,
+    help="Address to inject bitflip (if not specified, randomly selected)",
+)
+_INJECT_PARSER.add_argument(
+    "--bytewidth",
+    required=True,
+    type=int,
+    help="Byte width (default: 4 if address specified, 1 if random)",
+)
+_INJECT_PARSER.add_argument(
+    "--bit", required=True, type=int, help="Bit index within the integer to flip"
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_hex_address(expr):
+    """Parse a plain "0x..." address, None for anything gdb has to evaluate."""
+    digits = expr[2:]
+    if expr[:2] in ("0x", "0X") and digits and not digits.strip(string.hexdigits):
+        return int(digits, 16)
+    return None
+
+
+@BuildCmd.with_parser(_INJECT_PARSER)
+def inject(parsed):
     """Inject a bitflip at an address."""
 
-    parser = argparse.ArgumentParser(
-        description="Inject a bitflip at an address", prog="inject"
-    )
-    parser.add_argument(
-        "--address",
-        required=True,
-        help="Address to inject bitflip (if not specified, randomly selected)",
-    )
-    parser.add_argument(
-        "--bytewidth",
-        required=True,
-        type=int,
-        help="Byte width (default: 4 if address specified, 1 if random)",
-    )
-    parser.add_argument(
-        "--bit", required=True, type=int, help="Bit index within the integer to flip"
-    )
-
-    parsed = parse_args_safely(parser, args)
-    if parsed is None:
-        return
-
     if parsed.address:
-        # Support argument like "inject --address 0x1234+0x11 --bytewidth 4 --bit 3"
-        try:
-            address = int(gdb.parse_and_eval(parsed.address))
-        except Exception as e:
-            print("Error parsing address: %s" % str(e))
-            return
+        address = _parse_hex_address(parsed.address)
+        if address is None:
+            # Support argument like "inject --address 0x1234+0x11 --bytewidth 4 --bit 3"
+            try:
+                address = int(gdb.parse_and_eval(parsed.address))
+            except Exception as e:
+                print("Error parsing address: %s" % str(e))
+                return
         bytewidth = parsed.bytewidth if parsed.bytewidth is not None else 4
         if bytewidth < 1 or address < 0:
             print("invalid bytewidth or address")
@@ -107,29 +116,28 @@ def inject(args):
     inject_bitflip(address, bytewidth, bit)
 
 
-@BuildCmd
-def inject_reg(args):
+_INJECT_REG_PARSER = QuietArgumentParser(
+    description="Inject a bitflip into a register",
+    prog="inject_reg",
+)
+_INJECT_REG_PARSER.add_argument(
+    "--register",
+    required=True,
+    help="Register name (supports wildcards, if not specified, randomly selected)",
+)
+_INJECT_REG_PARSER.add_argument(
+    "--bit", required=True, type=int, help="Bit index to flip"
+)
+
+
+@BuildCmd.with_parser(_INJECT_REG_PARSER)
+def inject_reg(parsed):
     """Inject a bitflip into a register.
     usage: inject_reg [--register <register name>] [--bit <bit index>]
     if no register specified, will be randomly selected,
     a pattern involving wildcards can be specified if desired
     """
 
-    parser = argparse.ArgumentParser(
-        description="Inject a bitflip into a register",
-        prog="inject_reg",
-    )
-    parser.add_argument(
-        "--register",
-        required=True,
-        help="Register name (supports wildcards, if not specified, randomly selected)",
-    )
-    parser.add_argument("--bit", required=True, type=int, help="Bit index to flip")
-
-    parsed = parse_args_safely(parser, args)
-    if parsed is None:
-        return
-
     inject_reg_internal(parsed.register, parsed.bit)
 
 
@@ -143,27 +151,65 @@ def inject_reg(args):
 #     inject_instant_restart()
 
 
-@BuildCmd
-def loginject(args):
-    """Log the injection of a bitflip"""
+_LOGINJECT_PARSER = QuietArgumentParser(
+    description="Log the injection of a bitflip to a CSV file",
+    prog="loginject",
+)
+_LOGINJECT_PARSER.add_argument(
+    "--filename", required=True, help="CSV filename to log bitflip injections"
+)
 
-    parser = argparse.ArgumentParser(
-        description="Log the injection of a bitflip to a CSV file",
-        prog="loginject",
-    )
-    parser.add_argument(
-        "--filename", required=True, help="CSV filename to log bitflip injections"
-    )
 
-    parsed = parse_args_safely(parser, args)
-    if parsed is None:
-        return
+@BuildCmd.with_parser(_LOGINJECT_PARSER)
+def loginject(parsed):
+    """Log the injection of a bitflip"""
 
     init_logger(parsed.filename)
 
 
-@BuildCmd
-def autoinject(args):
+_FAULT_TYPES = frozenset(("ram", "reg"))
+
+
+def _fault_type(value):
+    # type= callable used instead of choices=, checked with one set lookup
+    if value not in _FAULT_TYPES:
+        raise argparse.ArgumentTypeError(
+            "invalid choice: %r (choose from 'ram', 'reg')" % value
+        )
+    return value
+
+
+_AUTOINJECT_PARSER = QuietArgumentParser(
+    description="Automatically inject faults into the VM",
+    prog="autoinject",
+)
+_AUTOINJECT_PARSER.add_argument(
+    "--total-fault-number",
+    type=int,
+    required=True,
+    help="Total number of faults to inject",
+)
+_AUTOINJECT_PARSER.add_argument(
+    "--min-interval",
+    required=True,
+    help="Minimum interval between injections (with unit: ns, us, ms, s, m)",
+)
+_AUTOINJECT_PARSER.add_argument(
+    "--max-interval",
+    required=True,
+    help="Maximum interval between injections (with unit: ns, us, ms, s, m)",
+)
+_AUTOINJECT_PARSER.add_argument(
+    "--fault-type",
+    type=_fault_type,
+    metavar="{ram,reg}",
+    required=True,
+    help="Type of fault to inject",
+)
+
+
+@BuildCmd.with_parser(_AUTOINJECT_PARSER)
+def autoinject(parsed):
     """Automatically inject fault into the VM accroding to the provided inject type.
     Cause `total_fault_number` faults with a random cycle between `min_interval` and `max_interval`,
     fault type is `fault_type`
@@ -174,37 +220,6 @@ def autoinject(args):
     1. ram: inject fault in RAM
     2. reg: inject fault in Registers"""
 
-    parser = argparse.ArgumentParser(
-        description="Automatically inject faults into the VM",
-        prog="autoinject",
-    )
-    parser.add_argument(
-        "--total-fault-number",
-        type=int,
-        required=True,
-        help="Total number of faults to inject",
-    )
-    parser.add_argument(
-        "--min-interval",
-        required=True,
-        help="Minimum interval between injections (with unit: ns, us, ms, s, m)",
-    )
-    parser.add_argument(
-        "--max-interval",
-        required=True,
-        help="Maximum interval between injections (with unit: ns, us, ms, s, m)",
-    )
-    parser.add_argument(
-        "--fault-type",
-        choices=["ram", "reg"],
-        required=True,
-        help="Type of fault to inject",
-    )
-
-    parsed = parse_args_safely(parser, args)
-    if parsed is None:
-        return
-
     try:
         times = getattr(parsed, "total_fault_number")
         assert times >= 1, "fatal: times < 1"
@@ -223,8 +238,59 @@ def autoinject(args):
     print("Total injection duration: %.3f s" % duration)
 
 
-@BuildCmd
-def snapinject(args):
+_SNAPINJECT_PARSER = QuietArgumentParser(
+    description="Custom snapshot-based fault injection with specific location",
+    prog="snapinject",
+)
+_SNAPINJECT_PARSER.add_argument(
+    "--total-fault-number",
+    type=int,
+    required=True,
+    help="Total number of faults to inject",
+)
+_SNAPINJECT_PARSER.add_argument(
+    "--min-interval",
+    required=True,
+    help="Minimum interval between injections (with unit: ns, us, ms, s, m)",
+)
+_SNAPINJECT_PARSER.add_argument(
+    "--max-interval",
+    required=True,
+    help="Maximum interval between injections (with unit: ns, us, ms, s, m)",
+)
+_SNAPINJECT_PARSER.add_argument(
+    "--fault-type",
+    type=_fault_type,
+    metavar="{ram,reg}",
+    required=True,
+    help="Type of fault to inject",
+)
+_SNAPINJECT_PARSER.add_argument(
+    "--fault-location",
+    required=False,
+    help="Fault location (address for RAM, register name for REG)",
+)
+_SNAPINJECT_PARSER.add_argument(
+    "--bit-index", type=int, required=False, help="Bit index to flip"
+)
+_SNAPINJECT_PARSER.add_argument(
+    "--observe-time",
+    required=True,
+    help="Time to observe after injection (with unit: ns, us, ms, s, m)",
+)
+_SNAPINJECT_PARSER.add_argument(
+    "--snapshot-tag",
+    help="Optional snapshot tag (if not provided, creates temporary snapshot)",
+)
+_SNAPINJECT_PARSER.add_argument(
+    "--serial-socket",
+    required=True,
+    help="The socket file used to send string to qemu serial",
+)
+
+
+@BuildCmd.with_parser(_SNAPINJECT_PARSER)
+def snapinject(parsed):
     """Record the current VM state, then automatically inject faults according to the user-provided fault count, fault location, and fault interval.
     After the faults are injected, wait for a while and then revert to the previous VM state, delete the tmp checkpoint.
     Usage: snapinject --total-fault-number <num> --min-interval <time> --max-interval <time> --fault-type <type> --fault-location <location> --bit-index <bit> --observe-time <time> [--snapshot-tag <tag>]
@@ -242,59 +308,6 @@ def snapinject(args):
     1. ram, address: inject fault in RAM, location is "address"
     2. reg, regname: inject fault in Registers, target is "regname"
     """
-    parser = argparse.ArgumentParser(
-        description="Custom snapshot-based fault injection with specific location",
-        prog="snapinject",
-    )
-    parser.add_argument(
-        "--total-fault-number",
-        type=int,
-        required=True,
-        help="Total number of faults to inject",
-    )
-    parser.add_argument(
-        "--min-interval",
-        required=True,
-        help="Minimum interval between injections (with unit: ns, us, ms, s, m)",
-    )
-    parser.add_argument(
-        "--max-interval",
-        required=True,
-        help="Maximum interval between injections (with unit: ns, us, ms, s, m)",
-    )
-    parser.add_argument(
-        "--fault-type",
-        choices=["ram", "reg"],
-        required=True,
-        help="Type of fault to inject",
-    )
-    parser.add_argument(
-        "--fault-location",
-        required=False,
-        help="Fault location (address for RAM, register name for REG)",
-    )
-    parser.add_argument(
-        "--bit-index", type=int, required=False, help="Bit index to flip"
-    )
-    parser.add_argument(
-        "--observe-time",
-        required=True,
-        help="Time to observe after injection (with unit: ns, us, ms, s, m)",
-    )
-    parser.add_argument(
-        "--snapshot-tag",
-        help="Optional snapshot tag (if not provided, creates temporary snapshot)",
-    )
-    parser.add_argument(
-        "--serial-socket",
-        required=True,
-        help="The socket file used to send string to qemu serial",
-    )
-
-    parsed = parse_args_safely(parser, args)
-    if parsed is None:
-        return
-
     try:
         times = getattr(parsed, "total_fault_number")
         assert times >= 1, "fatal: times < 1"
@@ -323,10 +336,10 @@ def snapinject(args):
         getattr(parsed, "snapshot_tag") if getattr(parsed, "snapshot_tag") else tmpname
     )
     if snapname == tmpname:
-        qemu_hmp("savevm %s" % snapname)
+        qemu_hmp_void("savevm %s" % snapname)
         print("Create a tmp checkpoint %s" % snapname)
     else:
-        qemu_hmp("loadvm %s" % snapname)
+        qemu_hmp_void("loadvm %s" % snapname)
         print("Load checkpoint %s" % snapname)
 
     stime = time.time()
@@ -356,10 +369,10 @@ def snapinject(args):
 
     if snapname == tmpname:
         # Revert to the previous VM state
-        qemu_hmp("loadvm %s" % snapname)
+        qemu_hmp_void("loadvm %s" % snapname)
         print("Back to checkpoint %s finished." % snapname)
         # Del this tmp VM checkpoint
-        qemu_hmp("delvm %s" % tmpname)
+        qemu_hmp_void("delvm %s" % tmpname)
         print("Delete tmp VM checkpoint")
 
     # Send a ret to qemu serial, make sure prompt is back
@@ -368,11 +381,11 @@ def snapinject(args):
 
 def parse_address_ranges_file(path):
     """
-    Parse an address range file of the following format and return a list of all injectable addresses:
+    Parse an address range file of the following format and return the list of (start, end) injectable ranges:
         0x0000000002800000-0x0000000002a00000
         0x0000000003400000-0x0000000003800000
     """
-    address_list = []
+    ranges = []
     with open(path, "r") as f:
         for line in f:
             line = line.strip()
@@ -382,43 +395,83 @@ def parse_address_ranges_file(path):
                 start_str, end_str = line.split("-")
                 start = int(start_str, 16)
                 end = int(end_str, 16)
-                address_list.extend(range(start, end, 1))  # 每 1 字节为单位注入
+                if end > start:
+                    ranges.append((start, end))  # 每 1 字节为单位注入
             except Exception as e:
                 print(f"Invalid line in range file: {line} ({e})")
-    return address_list
+    return ranges
 
 
-@BuildCmd
-def loop(args):
+def sample_range_addresses(ranges, count):
+    """
+    Pick `count` distinct byte addresses uniformly from the (start, end) ranges.
+
+    Byte offsets are drawn from the concatenation of all ranges and mapped back
+    to addresses through the cumulative range sizes, so memory stays O(count)
+    no matter how large the ranges are.
+    """
+    ends = [end for _, end in ranges]
+    offsets = list(itertools.accumulate(end - start for start, end in ranges))
+    addresses = []
+    for offset in random.sample(range(offsets[-1] if offsets else 0), count):
+        index = bisect.bisect_right(offsets, offset)
+        addresses.append(ends[index] - (offsets[index] - offset))
+    return addresses
+
+
+_LOOP_PARSER = QuietArgumentParser(
+    description="Loop an action for the specified number of times",
+    prog="loop",
+)
+_LOOP_PARSER.add_argument(
+    "--times", type=int, required=True, help="Number of times to repeat the command"
+)
+_LOOP_PARSER.add_argument("--command", required=True, help="Command to execute")
+_LOOP_PARSER.add_argument("--command-args", nargs="*", help="Arguments for the command")
+
+
+@BuildCmd.with_parser(_LOOP_PARSER)
+def loop(parsed):
     """Loop a action for provide times
     Usage: loop --times <num> --command <cmd> [--command-args <args>...]
     """
-    parser = argparse.ArgumentParser(
-        description="Loop an action for the specified number of times",
-        prog="loop",
-    )
-    parser.add_argument(
-        "--times", type=int, required=True, help="Number of times to repeat the command"
-    )
-    parser.add_argument("--command", required=True, help="Command to execute")
-    parser.add_argument("--command-args", nargs="*", help="Arguments for the command")
-
-    parsed = parse_args_safely(parser, args)
-    if parsed is None:
+    times = parsed.times
+    command_args = " ".join(getattr(parsed, "command_args") or [])
+
+    command = BuildCmd.commands.get(parsed.command)
+    if command is not None and command.parser is not None:
+        # Parse the arguments of our own commands once, then call them directly
+        # instead of going through gdb's command dispatch on every iteration.
+        command_parsed = parse_args_safely(command.parser, command_args)
+        if command_parsed is None:
+            return
+        for _ in range(times):
+            command.target(command_parsed)
         return
 
-    times = parsed.times
     # Reconstruct the full command with arguments
     actions = parsed.command
-    if getattr(parsed, "command_args"):
-        actions += " " + " ".join(getattr(parsed, "command_args"))
+    if command_args:
+        actions += " " + command_args
 
     for _ in range(times):
         gdb.execute(actions)
 
 
-@BuildCmd
-def appinject(args):
+_APPINJECT_PARSER = QuietArgumentParser(
+    description="Inject bitflips at address loaded from a file",
+    prog="appinject",
+)
+_APPINJECT_PARSER.add_argument(
+    "--total-fault-number", type=int, help="total fault number", required=True
+)
+_APPINJECT_PARSER.add_argument(
+    "--range-file", help="Description file of app memory map", required=True
+)
+
+
+@BuildCmd.with_parser(_APPINJECT_PARSER)
+def appinject(parsed):
     # TODO: Use argparse to parse the param here
     """Inject bitflips at addresses loaded from a file.
 
@@ -430,21 +483,6 @@ def appinject(args):
 
     """
 
-    parser = argparse.ArgumentParser(
-        description="Inject bitflips at address loaded from a file",
-        prog="appinject",
-    )
-    parser.add_argument(
-        "--total-fault-number", type=int, help="total fault number", required=True
-    )
-    parser.add_argument(
-        "--range-file", help="Description file of app memory map", required=True
-    )
-
-    parsed = parse_args_safely(parser, args)
-    if parsed is None:
-        return
-
     path = parsed.range_file
     try:
         count = int(parsed.total_fault_number)
@@ -454,35 +492,30 @@ def appinject(args):
         print("Invalid count")
         return
 
-    addresses = parse_address_ranges_file(path)
-    if len(addresses) == 0:
+    ranges = parse_address_ranges_file(path)
+    total = sum(end - start for start, end in ranges)
+    if total == 0:
         print("No valid addresses found in file.")
         return
-    if count > len(addresses):
-        print(
-            f"Requested {count} injections, but only {len(addresses)} addresses found."
-        )
+    if count > total:
+        print(f"Requested {count} injections, but only {total} addresses found.")
         return
 
-    print(
-        f"Performing {count} bitflip injections from {len(addresses)} available addresses..."
-    )
-    targets = random.sample(addresses, count)
-    for address in targets:
-        try:
-            inject_bitflip(address, 1)
-        except Exception as e:
-            print(f"Injection failed at 0x{address:x}: {e}")
+    print(f"Performing {count} bitflip injections from {total} available addresses...")
+    targets = sample_range_addresses(ranges, count)
+    inject_bitflip_batch(targets, 1)
 
 
-@BuildCmd
-def send_qemu_serial(args):
-    """Send `data` to QEMU serial"""
-    parser = argparse.ArgumentParser(
-        prog="send_qemu_serial", description="Send data to qemu serial"
-    )
-    parser.add_argument("--data", help="data sent to qemu serial", required=True)
+_SEND_QEMU_SERIAL_PARSER = QuietArgumentParser(
+    prog="send_qemu_serial", description="Send data to qemu serial"
+)
+_SEND_QEMU_SERIAL_PARSER.add_argument(
+    "--data", help="data sent to qemu serial", required=True
+)
 
-    parsed = parse_args_safely(parser, args)
+
+@BuildCmd.with_parser(_SEND_QEMU_SERIAL_PARSER)
+def send_qemu_serial(parsed):
+    """Send `data` to QEMU serial"""
     data = parsed.data
     send_to_qemu_serial(data)
@@ -1,18 +1,39 @@
+import atexit
 import csv
 
+# Number of rows buffered before they are written out
+LOG_BATCH_SIZE = 1024
+
 
 class CsvLogger:
     def __init__(self, filename) -> None:
         self.filename = filename
-        with open(self.filename, mode="w", newline="") as file:
-            writer = csv.writer(file)
-            # 写入表头
-            writer.writerow(["Address/Register", "Old Value", "New Value"])
+        # Keep the file open across rows, rows are written out in batches
+        self.file = open(self.filename, mode="w", newline="")
+        self.writer = csv.writer(self.file)
+        self.pending = []
+        # 写入表头
+        self.writer.writerow(["Address/Register", "Old Value", "New Value"])
+        self.file.flush()
+        atexit.register(self.close)
 
     def log(self, address_or_register, old_value, new_value):
-        with open(self.filename, mode="a", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow([address_or_register, old_value, new_value])
+        self.pending.append((address_or_register, old_value, new_value))
+        if len(self.pending) >= LOG_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.file.closed:
+            return
+        if self.pending:
+            self.writer.writerows(self.pending)
+            self.pending.clear()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        atexit.unregister(self.close)
 
 
 logger = None
@@ -20,9 +41,16 @@ logger = None
 
 def init_logger(filename):
     global logger
+    if logger:
+        logger.close()
     logger = CsvLogger(filename)
 
 
+def flush_logger():
+    if logger:
+        logger.flush()
+
+
 def log_single(address_or_register, old_value, new_value):
     if logger:
         logger.log(address_or_register, old_value, new_value)
@@ -1,32 +1,51 @@
+import argparse
+import functools
+import logging
 import shlex
-import sys
-from io import StringIO
+
+log = logging.getLogger(__name__)
+
+
+# Quoting and escape characters, arguments without any of them are split on
+# whitespace like shlex.split() would
+_SHLEX_SPECIAL = frozenset("\"'\\")
+
+
+class QuietArgumentParser(argparse.ArgumentParser):
+    """ArgumentParser that raises ArgumentError instead of exiting on errors."""
+
+    def error(self, message):
+        raise argparse.ArgumentError(None, message)
+
+
+@functools.lru_cache(maxsize=128)
+def _split_args(args_str):
+    # Split the arguments string properly handling quotes, cached because
+    # commands are often repeated with the very same arguments.
+    if _SHLEX_SPECIAL.isdisjoint(args_str):
+        # Plain addresses and numbers, no need for the shlex state machine
+        return tuple(args_str.split())
+    return tuple(shlex.split(args_str))
 
 
 def parse_args_safely(parser, args_str):
     """Safely parse arguments using argparse without causing system exit."""
 
     try:
-        # Split the arguments string properly handling quotes
-        args_list = shlex.split(args_str.strip()) if args_str.strip() else []
-
-        # Capture stderr to avoid argparse printing to terminal
-        old_stderr = sys.stderr
-        sys.stderr = StringIO()
-
-        try:
-            result = parser.parse_args(args_list)
-            return result
-        finally:
-            # Restore stderr
-            error_output = sys.stderr.getvalue()
-            sys.stderr = old_stderr
-            if error_output:
-                print(error_output.strip())
+        args_list = list(_split_args(args_str.strip()))
+        return parser.parse_args(args_list)
 
+    except argparse.ArgumentError as e:
+        # Raised by QuietArgumentParser, report it like argparse would. The
+        # usage is only formatted if the record is actually emitted.
+        if log.isEnabledFor(logging.ERROR):
+            usage = parser.format_usage().strip()
+            log.error("%s\n%s: error: %s", usage, parser.prog, e)
+        return None
     except SystemExit:
-        # argparse calls sys.exit() on error, we catch it and return None
+        # argparse calls sys.exit() on error and after --help, we catch it and
+        # return None
         return None
     except Exception as e:
-        print("Error parsing arguments: %s" % str(e))
+        log.error("Error parsing arguments: %s", e)
         return None
@@ -1,3 +1,5 @@
+import array
+import functools
 import random
 import re
 import socket
@@ -7,8 +9,19 @@ from logger import log_single
 
 import gdb
 
+# Memory range lines have format: "  start-end (prio N, type): name [optional_suffix]"
+_MEM_RANGE_RE = re.compile(
+    r"^\s*([0-9a-fA-F]+)-([0-9a-fA-F]+)\s+\(prio\s+(\d+),\s+([^)]+)\):\s+(\S+)"
+)
+
+# Types of the registers that bit flips are injected into
+_ALLOWED_REG_TYPES = frozenset(("long", "void *", "void (*)()", "union aarch64v"))
+
 
 class MemoryRange:
+    # one instance per range line of every mtree dump, keep them small
+    __slots__ = ("start", "end", "priority", "kind", "name")
+
     def __init__(self, start, end, priority, kind, name):
         self.start, self.end, self.priority, self.kind, self.name = (
             start,
@@ -32,32 +45,48 @@ class MemoryRange:
         Raises:
             ValueError: If line format is invalid
         """
-        # Pattern matches: start-end (prio N, type): name [optional_suffix]
-        pattern = (
-            r"^\s*([0-9a-fA-F]+)-([0-9a-fA-F]+)\s+\(prio\s+(\d+),\s+([^)]+)\):\s+(\S+)"
-        )
-        match = re.match(pattern, line.strip())
+        match = _MEM_RANGE_RE.match(line)
 
         if not match:
             raise ValueError(f"Invalid memory range line format: {line!r}")
 
         try:
-            return MemoryRange(
-                start=int(match.group(1), 16),
-                end=int(match.group(2), 16),
-                priority=int(match.group(3)),
-                kind=match.group(4).strip(),
-                name=match.group(5),
-            )
+            return MemoryRange.from_match(match)
         except (ValueError, IndexError) as e:
             raise ValueError(
                 f"Failed to parse memory range values from line {line!r}: {e}"
             )
 
+    @staticmethod
+    def from_match(match):
+        """
+        Build a MemoryRange object from a match of _MEM_RANGE_RE.
+
+        Args:
+            match (re.Match): Successful match of a memory range line
+
+        Returns:
+            MemoryRange: Parsed memory range object
+        """
+        return MemoryRange(
+            start=int(match.group(1), 16),
+            end=int(match.group(2), 16),
+            priority=int(match.group(3)),
+            kind=match.group(4).strip(),
+            name=match.group(5),
+        )
+
 
 class FlatView:
-    def __init__(self):
-        self.ranges = []
+    __slots__ = ("ranges", "_ram_starts", "_ram_ends", "_alias_prob", "_alias_idx")
+
+    def __init__(self, ranges=None):
+        self.ranges = ranges if ranges is not None else []
+        # RAM range bounds and their alias table, built lazily by random_address()
+        self._ram_starts = None
+        self._ram_ends = None
+        self._alias_prob = None
+        self._alias_idx = None
 
     @staticmethod
     def parse(lines):
@@ -82,51 +111,82 @@ class FlatView:
     def ram_ranges(self):
         return [(r.start, r.end) for r in self.ranges if r.kind == "ram"]
 
-    def random_address(self):
-        ranges = self.ram_ranges()
-        lens = [(end - start) for start, end in ranges]
-        offset = random.randint(0, sum(lens) - 1)
-        for start, end in ranges:
-            offset += start
-            if offset < end:
-                return offset
-            offset -= end
-        assert False, "should have been in range!"
-
-
-class RegistersMeta(type):
-    _instances = {}
-    _lock = threading.Lock()
-
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super().__call__(*args, **kwargs)
+    def _build_alias_table(self):
+        """
+        Build a Vose alias table over the RAM ranges weighted by their length,
+        so that a range can be drawn in O(1).
+        """
+        # Bounds are kept as two flat uint64 arrays instead of a list of tuples
+        starts = array.array("Q", (r.start for r in self.ranges if r.kind == "ram"))
+        ends = array.array("Q", (r.end for r in self.ranges if r.kind == "ram"))
+        if not starts:
+            raise ValueError("no RAM ranges to sample an address from")
+        k = len(starts)
+        total = sum(ends) - sum(starts)
+        scaled = [(end - start) * k / total for start, end in zip(starts, ends)]
+        prob = [1.0] * k
+        alias = list(range(k))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, g = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], g
+            scaled[g] -= 1.0 - scaled[s]
+            (small if scaled[g] < 1.0 else large).append(g)
+        # Whatever is left is numerically 1.0 and keeps prob 1.0
+        self._ram_starts, self._ram_ends = starts, ends
+        self._alias_prob, self._alias_idx = prob, alias
 
-        return cls._instances[cls]
+    def random_address(self):
+        if self._ram_starts is None:
+            self._build_alias_table()
+        i = random.randrange(len(self._ram_starts))
+        if random.random() >= self._alias_prob[i]:
+            i = self._alias_idx[i]
+        return random.randrange(self._ram_starts[i], self._ram_ends[i])
 
 
-class Registers(metaclass=RegistersMeta):
+class Registers:
     def __init__(self):
         self.cached_reg_list = None
+        self.cached_reg_names = None
 
     def list_registers(self):
         if self.cached_reg_list is None:
             # we can avoid needing to handle float and 'union neon_q', because on ARM, there are d# registers that alias
             # to all of the more specialized registers in question.
             frame = gdb.selected_frame()
-            self.cached_reg_list = [
-                (r, frame.read_register(r).type.sizeof)
-                for r in frame.architecture().registers()
-                if str(frame.read_register(r).type)
-                in ("long", "void *", "void (*)()", "union aarch64v")
-            ]
-        return self.cached_reg_list[:]
+            reg_list = []
+            for r in frame.architecture().registers():
+                reg_type = frame.read_register(r).type
+                if str(reg_type) in _ALLOWED_REG_TYPES:
+                    reg_list.append((r, reg_type.sizeof))
+            # stored as a tuple, so it can be handed out without a defensive copy
+            self.cached_reg_list = tuple(reg_list)
+            self.cached_reg_names = tuple(r.name for r, _ in self.cached_reg_list)
+        return self.cached_reg_list
+
+    def register_names(self):
+        if self.cached_reg_names is None:
+            self.list_registers()
+        return self.cached_reg_names
+
+
+@functools.lru_cache(maxsize=None)
+def get_registers():
+    """Return the shared Registers instance, its register list is cached."""
+    return Registers()
 
 
 def qemu_hmp(cmdstr):
     return gdb.execute("monitor %s" % cmdstr, to_string=True).strip()
 
 
+def qemu_hmp_void(cmdstr):
+    """Run a monitor command whose output is not needed, gdb prints it as is."""
+    gdb.execute("monitor %s" % cmdstr, to_string=False)
+
+
 def send_to_qemu_serial(cmdstr: str, socket_address):
     client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     try:
@@ -141,113 +201,139 @@ def send_to_qemu_serial(cmdstr: str, socket_address):
     return
 
 
-def mtree():
+# Time strings like "100", "20ns", "50us", "10ms", "2s" or "1m", no unit means ns
+_TIME_RE = re.compile(r"(\d+)(ns|us|ms|s|m|)")
+_TIME_UNITS = {
+    "": 1,
+    "ns": 1,
+    "us": 1000,
+    "ms": 1000 * 1000,
+    "s": 1000 * 1000 * 1000,
+    "m": 60 * 1000 * 1000 * 1000,
+}
+
+# Parsed output of "info mtree -f", the memory layout rarely changes while
+# injecting so it is only queried again after invalidate_mtree_cache(), which
+# runs whenever the inferior exits or the connection to QEMU goes away.
+_MTREE_CACHE = None
+
+# States of the _parse_mtree_output scanner
+_MTREE_BETWEEN, _MTREE_HEADER, _MTREE_ROOT, _MTREE_RANGES = range(4)
+
+
+def mtree(refresh=False):
     """
     Parse QEMU memory tree output and return a dictionary of FlatView objects.
 
+    The tree is cached for the current QEMU connection. The cache is dropped
+    by invalidate_mtree_cache(), which is called when the inferior exits or
+    gdb disconnects from QEMU, so a new instance is always queried again.
+
+    Args:
+        refresh (bool): Query QEMU again instead of returning the cached tree
+
     Returns:
         dict: Mapping of address space names to FlatView objects
     """
+    global _MTREE_CACHE
+    if _MTREE_CACHE is not None and not refresh:
+        return _MTREE_CACHE
     try:
         output = qemu_hmp("info mtree -f")
-        return _parse_mtree_output(output)
+        _MTREE_CACHE = _parse_mtree_output(output)
     except Exception as e:
         raise RuntimeError(f"Failed to parse memory tree: {e}")
+    return _MTREE_CACHE
+
+
+def invalidate_mtree_cache(event=None):
+    """Drop the cached memory tree, e.g. after the VM memory layout changed."""
+    global _MTREE_CACHE
+    _MTREE_CACHE = None
+
+
+# A reconnect may attach to a QEMU instance with a different memory layout.
+# connection_removed only exists since gdb 11.
+for _event in ("exited", "connection_removed"):
+    if hasattr(gdb.events, _event):
+        getattr(gdb.events, _event).connect(invalidate_mtree_cache)
 
 
 def _parse_mtree_output(output):
     """
     Parse the raw mtree output into structured data.
 
+    The dump is scanned in a single pass, tracking whether the current line
+    is between FlatView sections, in a section header (the AS lines), right
+    after the "Root" line or among the memory ranges of a section.
+
     Args:
         output (str): Raw output from 'monitor info mtree -f'
 
     Returns:
         dict: Mapping of address space names to FlatView objects
     """
-    lines = output.split("\n")
     views = {}
-
-    i = 0
-    while i < len(lines):
-        line = lines[i].rstrip()
+    # Warnings are collected and printed at once, writing to the gdb console
+    # line by line is slow on large malformed dumps.
+    diagnostics = []
+
+    state = _MTREE_BETWEEN
+    # address space name -> ranges of the FlatView section being parsed
+    section_views = {}
+    ranges = []
+    for line in output.splitlines():
+        if state == _MTREE_ROOT and line.startswith("  No rendered FlatView"):
+            # Empty FlatView - remove all address spaces for this view
+            section_views.clear()
+            state = _MTREE_BETWEEN
+            continue
+
+        if state in (_MTREE_ROOT, _MTREE_RANGES):
+            memory_range = _try_parse_range(line) if line.startswith("  ") else None
+            if memory_range is not None:
+                # Memory range line - shared by all address spaces in this FlatView
+                ranges.append(memory_range)
+                state = _MTREE_RANGES
+                continue
+            if line and not line.isspace() and not line.startswith("FlatView #"):
+                diagnostics.append(
+                    f"Warning: Unexpected line in memory ranges: {line!r}"
+                )
+                state = _MTREE_RANGES
+                continue
+            # Hit next section or end of this one
+            state = _MTREE_BETWEEN
+
+        elif state == _MTREE_HEADER:
+            if line.startswith(' AS "'):
+                as_name = _extract_address_space_name(line)
+                # All address spaces of one FlatView share the same parsed ranges
+                section_views[as_name] = ranges
+                continue
+            if line.startswith(" Root "):
+                # Found root section, now parse memory ranges
+                state = _MTREE_ROOT
+                continue
+            if not line.startswith("FlatView #"):
+                # Skip other lines in header
+                continue
+            state = _MTREE_BETWEEN
 
         if line.startswith("FlatView #"):
-            i, flatview_views = _parse_flatview_section(lines, i)
-            views.update(flatview_views)
-        else:
+            views.update(section_views)
+            section_views = {}
+            ranges = []
+            state = _MTREE_HEADER
+        elif line and not line.isspace():
             # Skip empty lines or unexpected content
-            if line and not line.isspace():
-                print(f"Warning: Unexpected line in mtree output: {line!r}")
-            i += 1
-
-    return {name: FlatView.parse(body) for name, body in views.items()}
-
-
-def _parse_flatview_section(lines, start_index):
-    """
-    Parse a single FlatView section starting from the given index.
-
-    Args:
-        lines (list): All lines from mtree output
-        start_index (int): Index of the "FlatView #" line
+            diagnostics.append(f"Warning: Unexpected line in mtree output: {line!r}")
 
-    Returns:
-        tuple: (next_index, dict of address_space_name -> memory_range_lines)
-    """
-    i = start_index + 1
-    address_spaces = []
-    views = {}
+    views.update(section_views)
 
-    # Parse AS (Address Space) lines
-    while i < len(lines):
-        line = lines[i].rstrip()
-
-        if line.startswith(' AS "'):
-            as_name = _extract_address_space_name(line)
-            address_spaces.append(as_name)
-            views[as_name] = []
-        elif line.startswith(" Root "):
-            # Found root section, now parse memory ranges
-            i += 1
-            break
-        elif line.startswith("FlatView #"):
-            # Hit next FlatView section
-            return i, views
-        else:
-            # Skip other lines in header
-            pass
-        i += 1
-
-    # Parse memory ranges or handle empty FlatView
-    if i < len(lines):
-        line = lines[i].rstrip()
-        if line.startswith("  No rendered FlatView"):
-            # Empty FlatView - remove all address spaces for this view
-            for as_name in address_spaces:
-                # Avoid double free
-                if as_name in views:
-                    del views[as_name]
-            i += 1
-        else:
-            # Parse memory range lines
-            while i < len(lines):
-                line = lines[i].rstrip()
-
-                if line.startswith("  ") and _is_memory_range_line(line):
-                    # Memory range line - add to all address spaces in this FlatView
-                    for as_name in address_spaces:
-                        views[as_name].append(line)
-                elif line.startswith("FlatView #") or not line:
-                    # Hit next section or end
-                    break
-                else:
-                    # Skip unexpected lines
-                    if line and not line.isspace():
-                        print(f"Warning: Unexpected line in memory ranges: {line!r}")
-                i += 1
-
-    return i, views
+    if diagnostics:
+        print("\n".join(diagnostics))
+    return {name: FlatView(ranges=body) for name, body in views.items()}
 
 
 def _extract_address_space_name(line):
@@ -263,48 +349,99 @@ def _extract_address_space_name(line):
     Raises:
         ValueError: If line format is invalid
     """
-    if line.count('"') != 2:
+    parts = line.split('"', 2)
+    if len(parts) < 3:
         raise ValueError(f"Invalid AS line format: {line!r}")
 
-    return line.split('"')[1]
+    return parts[1]
 
 
-def _is_memory_range_line(line):
+def _try_parse_range(line):
     """
-    Check if a line represents a memory range.
+    Parse a line if it represents a memory range.
 
     Args:
-        line (str): Line to check
+        line (str): Line to parse
 
     Returns:
-        bool: True if line is a memory range
+        MemoryRange: Parsed memory range, or None if line is not a memory range
     """
-    # Memory range lines have format: "  start-end (prio N, type): name"
-    pattern = r"^\s*[0-9a-fA-F]+-[0-9a-fA-F]+\s+\(prio\s+\d+,\s+[^)]+\):\s+\S+"
-    return bool(re.match(pattern, line))
+    match = _MEM_RANGE_RE.match(line)
+    if match is None:
+        return None
+    return MemoryRange.from_match(match)
 
 
 def sample_address():
     return mtree()["memory"].random_address()
 
 
+def _flip_memory_bit(inferior, address, bytewidth, bit):
+    assert 0 <= bit < bytewidth * 8, "invalid bit index: %d" % bit
+    # Flip the bit inside the byte buffer instead of round-tripping the whole
+    # value through a Python int.
+    buf = bytearray(inferior.read_memory(address, bytewidth))
+    # endianness doesn't actually matter for this purpose, so always use little-endian
+    ovalue = int.from_bytes(buf, "little")
+    byte_index, bit_in_byte = divmod(bit, 8)
+    buf[byte_index] ^= 1 << bit_in_byte
+    # write_memory takes any buffer, so the bytearray is passed as is
+    inferior.write_memory(address, buf)
+
+    # only the mutated byte can differ, so only that one is read back
+    rbyte = inferior.read_memory(address + byte_index, 1).tobytes()[0]
+
+    nvalue = int.from_bytes(buf, "little")
+    assert rbyte == buf[byte_index], "mismatched values: o=0x%x n=0x%x rb=0x%x" % (
+        ovalue,
+        nvalue,
+        rbyte,
+    )
+    return ovalue, nvalue
+
+
 def inject_bitflip(address, bytewidth, bit=None):
     assert bytewidth >= 1, "invalid bytewidth: %u" % bytewidth
     if bit is None:
         bit = random.randint(0, bytewidth * 8 - 1)
 
     inferior = gdb.selected_inferior()
-    # endianness doesn't actually matter for this purpose, so always use little-endian
-    ovalue = int.from_bytes(inferior.read_memory(address, bytewidth), "little")
-    nvalue = ovalue ^ (1 << bit)
-    inferior.write_memory(address, int.to_bytes(nvalue, bytewidth, "little"))
+    ovalue, nvalue = _flip_memory_bit(inferior, address, bytewidth, bit)
+    log_single(hex(address), hex(ovalue), hex(nvalue))
 
-    rnvalue = int.from_bytes(inferior.read_memory(address, bytewidth), "little")
 
-    assert nvalue == rnvalue and nvalue != ovalue, (
-        "mismatched values: o=0x%x n=0x%x rn=0x%x" % (ovalue, nvalue, rnvalue)
-    )
-    log_single(hex(address), hex(ovalue), hex(nvalue))
+def inject_bitflip_batch(addresses, bytewidth=1):
+    """
+    Flip one random bit at each of the given addresses.
+
+    The inferior is looked up once for the whole batch and the injections are
+    logged after the loop, so the per-address work is only the memory access.
+
+    Args:
+        addresses (iterable): Addresses to inject bitflips into
+        bytewidth (int): Byte width of every injected value
+
+    Returns:
+        list: (address, old value, new value) of every successful injection
+    """
+    assert bytewidth >= 1, "invalid bytewidth: %u" % bytewidth
+    inferior = gdb.selected_inferior()
+    nbits = bytewidth * 8
+    randrange = random.randrange
+    injected = []
+    try:
+        for address in addresses:
+            try:
+                bit = randrange(nbits)
+                ovalue, nvalue = _flip_memory_bit(inferior, address, bytewidth, bit)
+            except Exception as e:
+                print(f"Injection failed at 0x{address:x}: {e}")
+                continue
+            injected.append((address, ovalue, nvalue))
+    finally:
+        for address, ovalue, nvalue in injected:
+            log_single(hex(address), hex(ovalue), hex(nvalue))
+    return injected
 
 
 def inject_register_bitflip(register_name, bit=None):
@@ -343,24 +480,13 @@ def inject_register_bitflip(register_name, bit=None):
 
             # random pick upper 64 or lower 64
             index = random.randint(0, 1)
-            oldval = int(
-                gdb.execute(
-                    "p ((int64_t[2])$%s)[%d]" % (register_name, index), to_string=True
-                )
-                .split("=")[1]
-                .strip()
-            )
+            # Evaluate the half directly as a gdb.Value instead of parsing
+            # the output of a "print" command.
+            half = "((int64_t[2])$%s)[%d]" % (register_name, index)
+            oldval = int(gdb.parse_and_eval(half))
             newval = oldval ^ (1 << bit)
-            gdb.execute(
-                "set ((int64_t[2])$%s)[%d] = %d" % (register_name, index, newval)
-            )
-            rrval = int(
-                gdb.execute(
-                    "p ((int64_t[2])$%s)[%d]" % (register_name, index), to_string=True
-                )
-                .split("=")[1]
-                .strip()
-            )
+            gdb.execute("set %s = %d" % (half, newval))
+            rrval = int(gdb.parse_and_eval(half))
         else:
             # normal register, 64 bits
             assert value.type.sizeof == 8, (
@@ -390,17 +516,32 @@ def inject_register_bitflip(register_name, bit=None):
         print("[inject_register_bitflip] exception: ", e)
 
 
+@functools.lru_cache(maxsize=32)
+def _compile_reg_wildcard(pattern):
+    """Return a predicate telling whether a register name matches pattern."""
+    segments = pattern.split("*")
+    if len(segments) == 1:
+        return pattern.__eq__
+    if len(segments) == 2:
+        # A single "*" only needs a prefix and a suffix check, no regex
+        prefix, suffix = segments
+        minlen = len(prefix) + len(suffix)
+        return lambda name: (
+            len(name) >= minlen and name.startswith(prefix) and name.endswith(suffix)
+        )
+    regexp = re.compile(
+        "^" + ".*".join(re.escape(segment) for segment in segments) + "$"
+    )
+    return lambda name: regexp.match(name) is not None
+
+
 def inject_reg_internal(register_name, bit=None):
-    register = Registers()
-    registers = [r.name for r, nb in register.list_registers()]
+    register = get_registers()
+    registers = list(register.register_names())
     if register_name:
         # Support wildcard input like "r*x"
-        regexp = re.compile(
-            "^"
-            + ".*".join(re.escape(segment) for segment in register_name.split("*"))
-            + "$"
-        )
-        registers = [rname for rname in registers if regexp.match(rname)]
+        matches = _compile_reg_wildcard(register_name)
+        registers = [rname for rname in registers if matches(rname)]
     if not registers:
         print("No registers found!")
         return
@@ -418,13 +559,16 @@ def inject_reg_internal(register_name, bit=None):
 
 
 def autoinject_inner(times, mint, maxt, ftype):
+    # Query the layout once per command, it is then reused for every fault
+    memory = mtree(refresh=True)["memory"] if ftype == "ram" else None
+    randint = random.randint
     for _ in range(times):
-        step_ns(random.randint(mint, maxt))
+        step_ns(randint(mint, maxt))
 
         if ftype == "reg":
             inject_reg_internal(None)
         elif ftype == "ram":
-            inject_bitflip(sample_address(), 1)
+            inject_bitflip(memory.random_address(), 1)
 
 
 def inject_instant_restart():
@@ -459,25 +603,9 @@ def step_ns(ns):
         gdb.execute("continue")
 
 
+@functools.lru_cache(maxsize=1024)
 def parse_time(s):
-    time_units = {
-        "": 1,
-        "ns": 1,
-        "us": 1000,
-        "ms": 1000 * 1000,
-        "s": 1000 * 1000 * 1000,
-        "m": 60 * 1000 * 1000 * 1000,
-    }
-    for unit, mul in sorted(time_units.items()):
-        if s.endswith(unit):
-            try:
-                if len(unit) == 0:
-                    res = int(s)
-                else:
-                    res = int(s[: -len(unit)])
-            except ValueError:
-                continue  # try the next unit
-            if res < 0:
-                raise ValueError("expected non-positive number of %s in %r" % (unit, s))
-            return res * mul
-    raise ValueError("could not parse units in %r" % s)
+    match = _TIME_RE.fullmatch(s)
+    if match is None:
+        raise ValueError("could not parse units in %r" % s)
+    return int(match.group(1)) * _TIME_UNITS[match.group(2)]
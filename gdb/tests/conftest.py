@@ -0,0 +1,27 @@
+"""
+Shared pytest setup for the gdb scripts.
+
+The `gdb` module only exists inside gdb's embedded Python. When the tests run
+outside of gdb, a minimal stand-in is installed so that the pure helpers in
+fliputils and qemu_utils can be imported; anything that talks to a live gdb
+session still has to be tested from within gdb.
+"""
+
+import sys
+import types
+
+try:
+    import gdb  # noqa: F401
+except ImportError:
+    gdb = types.ModuleType("gdb")
+
+    class Command:
+        def __init__(self, name, command_class):
+            self.name = name
+
+    gdb.Command = Command
+    gdb.COMMAND_USER = 13
+    gdb.COMPLETE_NONE = 0
+    # No gdb events to connect to outside of gdb
+    gdb.events = types.SimpleNamespace()
+    sys.modules["gdb"] = gdb
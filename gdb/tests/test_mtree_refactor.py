@@ -3,6 +3,7 @@
 Test script to verify the refactored mtree parsing functionality.
 """
 
+import random
 import sys
 import os
 
@@ -89,6 +90,42 @@ def test_flatview_parsing():
     print("✓ FlatView.parse tests passed")
 
 
+def test_flatview_random_address():
+    """Test FlatView.random_address sampling."""
+    print("Testing FlatView.random_address...")
+
+    random.seed(0)
+    ram = [(0x1000, 0x1100), (0x9000, 0x9004)]
+    flatview = FlatView(
+        ranges=[
+            MemoryRange(0x0, 0x1000, 0, "i/o", "io"),
+            MemoryRange(ram[0][0], ram[0][1], 0, "ram", "ram0"),
+            MemoryRange(0x5000, 0x6000, 0, "romd", "flash"),
+            MemoryRange(ram[1][0], ram[1][1], 0, "ram", "ram1"),
+        ]
+    )
+
+    hits = set()
+    for _ in range(5000):
+        address = flatview.random_address()
+        # Always inside a RAM range, so the i/o and romd ranges are never sampled
+        index = next(i for i, (lo, hi) in enumerate(ram) if lo <= address < hi)
+        hits.add(index)
+    # Even the tiny range is drawn now and then
+    assert hits == {0, 1}
+
+    # A view without RAM ranges cannot be sampled
+    no_ram = FlatView(ranges=[MemoryRange(0x0, 0x1000, 0, "i/o", "io")])
+    for empty in (FlatView(), no_ram):
+        try:
+            empty.random_address()
+            assert False, "Should have raised ValueError"
+        except ValueError:
+            pass  # Expected
+
+    print("✓ FlatView.random_address tests passed")
+
+
 def test_mtree_output_parsing():
     """Test the complete mtree output parsing."""
     print("Testing _parse_mtree_output...")
@@ -154,6 +191,7 @@ def main():
     try:
         test_memory_range_parsing()
         test_flatview_parsing()
+        test_flatview_random_address()
         test_mtree_output_parsing()
         test_error_handling()
 
@@ -0,0 +1,55 @@
+"""
+Tests for the register name wildcards accepted by inject_reg.
+"""
+
+import itertools
+import re
+
+import pytest
+
+from qemu_utils import _compile_reg_wildcard
+
+
+def _reference(pattern):
+    # The escaped regex the wildcards used to be compiled to
+    return re.compile(
+        "^" + ".*".join(re.escape(segment) for segment in pattern.split("*")) + "$"
+    )
+
+
+@pytest.mark.parametrize(
+    "pattern,name,expected",
+    [
+        # no "*": exact match
+        ("x0", "x0", True),
+        ("x0", "x01", False),
+        ("x0", "x", False),
+        # one "*"
+        ("x*", "x29", True),
+        ("*sp", "sp", True),
+        ("*sp", "cpsr", False),
+        ("x*x", "xx", True),
+        ("x*x", "x0x", True),
+        ("x*x", "x", False),  # prefix and suffix may not overlap
+        ("*", "", True),
+        # several "*"
+        ("x*1*", "x10", True),
+        ("*a*a*", "a", False),
+        ("*a*a*", "aba", True),
+        ("**", "pc", True),
+    ],
+)
+def test_wildcard_cases(pattern, name, expected):
+    assert _compile_reg_wildcard(pattern)(name) is expected
+
+
+_NAMES = ["".join(t) for n in range(5) for t in itertools.product("ab", repeat=n)]
+_PATTERNS = ["".join(t) for n in range(5) for t in itertools.product("ab*", repeat=n)]
+
+
+@pytest.mark.parametrize("pattern", _PATTERNS)
+def test_wildcard_matches_reference_regex(pattern):
+    matches = _compile_reg_wildcard(pattern)
+    regexp = _reference(pattern)
+    for name in _NAMES:
+        assert matches(name) == (regexp.match(name) is not None), name
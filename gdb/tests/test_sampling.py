@@ -0,0 +1,39 @@
+"""
+Tests for the address sampling used by appinject.
+"""
+
+import random
+
+import pytest
+
+from fliputils import sample_range_addresses
+
+RANGES = [(0x1000, 0x1010), (0x2000, 0x2001), (0x3000, 0x3040)]
+TOTAL = sum(end - start for start, end in RANGES)
+
+
+def _in_some_range(address):
+    return any(start <= address < end for start, end in RANGES)
+
+
+@pytest.mark.parametrize("count", [0, 1, 10, TOTAL - 1])
+def test_samples_are_distinct_and_inside_ranges(count):
+    random.seed(count)
+    addresses = sample_range_addresses(RANGES, count)
+    assert len(addresses) == count
+    assert len(set(addresses)) == count
+    assert all(_in_some_range(address) for address in addresses)
+
+
+def test_sampling_everything_returns_the_population():
+    population = {a for start, end in RANGES for a in range(start, end)}
+    assert set(sample_range_addresses(RANGES, TOTAL)) == population
+
+
+def test_too_many_samples_raise():
+    with pytest.raises(ValueError):
+        sample_range_addresses(RANGES, TOTAL + 1)
+
+
+def test_no_ranges():
+    assert sample_range_addresses([], 0) == []
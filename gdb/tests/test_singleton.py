@@ -1,12 +1,12 @@
-from qemu_utils import Registers
+from qemu_utils import get_registers
 
 
 def test_singleton():
     """测试单例模式"""
     print("test singleton started")
     # 测试 Registers 单例
-    reg1 = Registers()
-    reg2 = Registers()
+    reg1 = get_registers()
+    reg2 = get_registers()
 
     assert reg1 is reg2
     assert reg1.list_registers() != None and len(reg1.list_registers()) > 0